@@ -1,9 +1,175 @@
+import functools
+import threading
+
+from collections import OrderedDict
+from io import BytesIO
+from typing import NamedTuple
+
 from PIL import Image, ImageDraw, ImageFont
 
 
 TEXT_FILL_COLOR = (255, 255, 255)
 TEXT_STROKE_COLOR = (0, 0, 0)
 
+_BASE_FONTS: dict[str, ImageFont.FreeTypeFont] = {}
+# Sizes follow the uploaded image's height, so keep the cache an LRU.
+_FONT_CACHE: OrderedDict[tuple[str, int], ImageFont.FreeTypeFont] = OrderedDict()
+_FONT_CACHE_SIZE = 128
+_FONT_LOCK = threading.Lock()
+
+
+def get_font(font_path: str, size: int) -> ImageFont.FreeTypeFont:
+    """Return a cached FreeType font for *font_path* at *size*.
+
+    The TTF is read from disk once per path; other sizes are derived from
+    that base face with ``font_variant`` and kept in a bounded LRU.
+    """
+    key = (font_path, size)
+    with _FONT_LOCK:
+        font = _FONT_CACHE.get(key)
+        if font is not None:
+            _FONT_CACHE.move_to_end(key)
+            return font
+
+        base = _BASE_FONTS.get(font_path)
+        if base is None:
+            # Loading from bytes makes font_variant() reuse them instead
+            # of re-opening the file for every new size.
+            with open(font_path, "rb") as f:
+                base = ImageFont.truetype(BytesIO(f.read()), size)
+            _BASE_FONTS[font_path] = base
+        font = base if base.size == size else base.font_variant(size=size)
+        _FONT_CACHE[key] = font
+        while len(_FONT_CACHE) > _FONT_CACHE_SIZE:
+            _FONT_CACHE.popitem(last=False)
+    return font
+
+
+@functools.lru_cache(maxsize=128)
+def _cap_bottom(font: ImageFont.FreeTypeFont) -> int:
+    """Bottom edge of ``"A"``, which Pillow uses as the multiline line pitch."""
+    return font.getbbox("A")[3]
+
+
+class _Glyph(NamedTuple):
+    """Pre-rendered fill and outline masks of one character at one size."""
+
+    fill_mask: Image.Image | None
+    fill_offset: tuple[int, int]
+    stroke_mask: Image.Image | None
+    stroke_offset: tuple[int, int]
+    advance: float
+
+
+def _stroke_width(font: ImageFont.FreeTypeFont) -> int:
+    """Outline width proportional to the font size."""
+    return max(1, font.size // 12)
+
+
+def _glyph_nbytes(glyph: _Glyph) -> int:
+    return sum(
+        mask.width * mask.height
+        for mask in (glyph.fill_mask, glyph.stroke_mask)
+        if mask is not None
+    )
+
+
+# Keys come from user text and mask size grows with the font size, so the
+# atlas is an LRU bounded by mask bytes: printable ASCII at typical caption
+# sizes stays resident, while CJK / emoji text or huge glyphs cannot grow
+# the process without limit. A glyph above the per-entry cap is not cached.
+_GLYPH_ATLAS: OrderedDict[tuple[ImageFont.FreeTypeFont, str], _Glyph] = (
+    OrderedDict()
+)
+_GLYPH_ATLAS_MAX_BYTES = 16 * 1024 * 1024
+_GLYPH_ATLAS_MAX_ENTRY_BYTES = 256 * 1024
+_GLYPH_LOCK = threading.Lock()
+_glyph_atlas_bytes = 0
+
+
+def _rasterize(
+    font: ImageFont.FreeTypeFont,
+    char: str,
+    stroke_width: int = 0,
+) -> tuple[Image.Image | None, tuple[int, int]]:
+    """Render *char* into a tight ``L`` mask; return (mask, offset).
+
+    With *stroke_width* the mask is FreeType's stroked outline, costing one
+    rasterisation regardless of the width. The offset is relative to the
+    left/ascender origin of the glyph.
+    """
+    left, top, right, bottom = font.getbbox(char, stroke_width=stroke_width)
+    if right <= left or bottom <= top:
+        return None, (0, 0)
+    mask = Image.new("L", (right - left, bottom - top), 0)
+    ImageDraw.Draw(mask).text(
+        (-left, -top),
+        char,
+        font=font,
+        fill=255,
+        stroke_width=stroke_width,
+        stroke_fill=255,
+    )
+    return mask, (left, top)
+
+
+def _get_glyph(font: ImageFont.FreeTypeFont, char: str) -> _Glyph:
+    """Return the cached masks, offsets and advance for *char* in *font*.
+
+    Fonts usually come from :func:`get_font`'s cache, so each
+    (size, character) pair is rasterised and stroked by FreeType only once
+    while it stays in the LRU. Offsets are relative to the
+    left/ascender origin of the glyph.
+    """
+    key = (font, char)
+    with _GLYPH_LOCK:
+        glyph = _GLYPH_ATLAS.get(key)
+        if glyph is not None:
+            _GLYPH_ATLAS.move_to_end(key)
+            return glyph
+
+    fill_mask, fill_offset = _rasterize(font, char)
+    stroke_mask, stroke_offset = _rasterize(font, char, _stroke_width(font))
+    glyph = _Glyph(
+        fill_mask, fill_offset, stroke_mask, stroke_offset, font.getlength(char),
+    )
+    nbytes = _glyph_nbytes(glyph)
+    if nbytes > _GLYPH_ATLAS_MAX_ENTRY_BYTES:
+        return glyph
+
+    global _glyph_atlas_bytes
+    with _GLYPH_LOCK:
+        if key not in _GLYPH_ATLAS:
+            _GLYPH_ATLAS[key] = glyph
+            _glyph_atlas_bytes += nbytes
+        while _glyph_atlas_bytes > _GLYPH_ATLAS_MAX_BYTES:
+            _, evicted = _GLYPH_ATLAS.popitem(last=False)
+            _glyph_atlas_bytes -= _glyph_nbytes(evicted)
+    return glyph
+
+
+def _first_fit_breaks(
+    widths: list[float],
+    space_width: float,
+    max_width: float,
+) -> list[int]:
+    """Return greedy first-fit line break indices for words of *widths*.
+
+    The result starts with ``0`` and ends with ``len(widths)``; line ``i``
+    holds the words ``widths[breaks[i]:breaks[i + 1]]``.
+    """
+    breaks = [0]
+    current_width = widths[0]
+    for index in range(1, len(widths)):
+        candidate_width = current_width + space_width + widths[index]
+        if candidate_width <= max_width:
+            current_width = candidate_width
+        else:
+            breaks.append(index)
+            current_width = widths[index]
+    breaks.append(len(widths))
+    return breaks
+
 
 class MemeTextRenderer:
     """Renders auto-wrapped, auto-sized meme text onto an image.
@@ -11,49 +177,147 @@ class MemeTextRenderer:
     For each text block (top / bottom) the renderer:
 
     1. Reserves a *zone* — a percentage of the image height where text may live.
-    2. Starting from the largest font size that looks good, wraps the text
-       word-by-word using actual pixel measurements (``textbbox``).
-    3. Shrinks the font until the wrapped block fits inside the zone.
-    4. Draws the result centred horizontally with a proportional outline stroke.
+    2. Wraps the text word-by-word using cached per-word advance widths
+       (``getlength``).
+    3. Binary-searches for the largest font size whose wrapped block fits
+       inside the zone, then re-breaks the lines with an optimal-fit pass.
+    4. Draws the result centred horizontally with a proportional outline
+       stroke, blitting cached per-glyph masks instead of re-shaping text.
     """
 
     HORIZONTAL_PADDING_RATIO = 0.05
     VERTICAL_PADDING_RATIO = 0.04
     TEXT_ZONE_RATIO = 0.35
     MAX_FONT_HEIGHT_RATIO = 0.14
+    MAX_FONT_WIDTH_RATIO = 0.3
     MIN_FONT_SIZE = 10
+    LINE_SPACING = 4
 
     def __init__(self, image: Image.Image, font_path: str) -> None:
         self._image = image
         self._font_path = font_path
-        self._draw = ImageDraw.Draw(image)
         self._img_width, self._img_height = image.size
 
+        # Text zone geometry depends only on the image size; compute it once.
+        h_pad = int(self._img_width * self.HORIZONTAL_PADDING_RATIO)
+        self._v_pad = int(self._img_height * self.VERTICAL_PADDING_RATIO)
+        self._max_width = self._img_width - 2 * h_pad
+        self._max_height = int(self._img_height * self.TEXT_ZONE_RATIO)
+        # Tall uploads must not push a short word to hundreds of pixels: text
+        # can never usefully outgrow the image width.
+        self._max_font_size = max(
+            self.MIN_FONT_SIZE,
+            min(
+                int(self._img_height * self.MAX_FONT_HEIGHT_RATIO),
+                int(self._img_width * self.MAX_FONT_WIDTH_RATIO),
+            ),
+        )
+        self._center_x = self._img_width / 2
+
+    @classmethod
+    def _line_pitch(
+        cls,
+        font: ImageFont.FreeTypeFont,
+        stroke_width: int = 0,
+    ) -> int:
+        """Distance between consecutive line origins, as Pillow lays it out.
+
+        Mirrors ``ImageDraw._multiline_spacing``: a stroked block is spaced
+        ``2 * stroke_width`` wider than an unstroked one.
+        """
+        return _cap_bottom(font) + 2 * stroke_width + cls.LINE_SPACING
+
+    def _block_height(
+        self,
+        font: ImageFont.FreeTypeFont,
+        lines: list[str],
+    ) -> int:
+        """Ink height of *lines*, matching the unstroked
+        ``multiline_textbbox`` the fit has always measured, without laying
+        every line out again."""
+        if not lines:
+            return 0
+        top = font.getbbox(lines[0])[1]
+        bottom = font.getbbox(lines[-1])[3]
+        return (len(lines) - 1) * self._line_pitch(font) + bottom - top
+
+    @staticmethod
+    def _measure_words(
+        words: list[str],
+        font: ImageFont.FreeTypeFont,
+    ) -> tuple[list[float], float]:
+        """Return (per-word advance widths, space width), measuring each
+        unique word only once."""
+        unique = {word: font.getlength(word) for word in set(words)}
+        return [unique[word] for word in words], font.getlength(" ")
+
     def _wrap_text(
         self,
         text: str,
         font: ImageFont.FreeTypeFont,
         max_width: int,
-    ) -> str:
-        """Word-wrap *text* so every line fits within *max_width* pixels."""
+    ) -> list[str]:
+        """Word-wrap *text* so every line fits within *max_width* pixels.
+
+        Greedy first-fit: lines are built by summing cached advance widths,
+        instead of re-shaping every growing candidate line.
+        """
         words = text.split()
         if not words:
-            return ""
+            return []
 
-        lines: list[str] = []
-        current_line = words[0]
+        widths, space_width = self._measure_words(words, font)
+        breaks = _first_fit_breaks(widths, space_width, max_width)
+        return [
+            " ".join(words[start:end])
+            for start, end in zip(breaks, breaks[1:])
+        ]
 
-        for word in words[1:]:
-            candidate = f"{current_line} {word}"
-            bbox = self._draw.textbbox((0, 0), candidate, font=font)
-            if (bbox[2] - bbox[0]) <= max_width:
-                current_line = candidate
-            else:
-                lines.append(current_line)
-                current_line = word
+    def _wrap_text_optimal(
+        self,
+        text: str,
+        font: ImageFont.FreeTypeFont,
+        max_width: int,
+    ) -> list[str]:
+        """Word-wrap *text* minimising raggedness (Knuth-style optimal fit).
 
-        lines.append(current_line)
-        return "\n".join(lines)
+        Each line costs the squared slack left at its end; the last line is
+        free. Slower than :meth:`_wrap_text`, so it is only used once for the
+        final, already-fitted font.
+        """
+        words = text.split()
+        if not words:
+            return []
+
+        widths, space_width = self._measure_words(words, font)
+        count = len(words)
+
+        # best[j] is the minimal cost of laying out words[:j];
+        # breaks[j] is where the last line of that layout starts.
+        best = [0.0] + [float("inf")] * count
+        breaks = [0] * (count + 1)
+
+        for end in range(1, count + 1):
+            line_width = -space_width
+            for start in range(end - 1, -1, -1):
+                line_width += widths[start] + space_width
+                if line_width > max_width and start < end - 1:
+                    break
+                slack = max(0.0, max_width - line_width)
+                cost = best[start] + (0.0 if end == count else slack * slack)
+                if cost < best[end]:
+                    best[end] = cost
+                    breaks[end] = start
+
+        lines: list[str] = []
+        end = count
+        while end > 0:
+            start = breaks[end]
+            lines.append(" ".join(words[start:end]))
+            end = start
+
+        lines.reverse()
+        return lines
 
     def _fit_text(
         self,
@@ -62,20 +326,36 @@ class MemeTextRenderer:
         max_height: int,
     ) -> tuple[ImageFont.FreeTypeFont, str]:
         """Return the largest font + wrapped text that fits the given box."""
-        max_font_size = max(
-            self.MIN_FONT_SIZE,
-            int(self._img_height * self.MAX_FONT_HEIGHT_RATIO),
-        )
+        # "Fits in the zone" is monotonic in font size, so binary-search for
+        # the largest size that fits instead of probing every size. The block
+        # height follows from the line pitch plus the first/last line ink, so
+        # probes never lay the whole wrapped text out a second time.
+        lo, hi = self.MIN_FONT_SIZE, self._max_font_size
+        best: tuple[ImageFont.FreeTypeFont, list[str]] | None = None
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            font = get_font(self._font_path, mid)
+            lines = self._wrap_text(text, font, max_width)
+            if self._block_height(font, lines) <= max_height:
+                lo = mid
+                best = font, lines
+            else:
+                hi = mid - 1
 
-        for size in range(max_font_size, self.MIN_FONT_SIZE - 1, -1):
-            font = ImageFont.truetype(self._font_path, size)
-            wrapped = self._wrap_text(text, font, max_width)
-            bbox = self._draw.multiline_textbbox((0, 0), wrapped, font=font)
-            if (bbox[3] - bbox[1]) <= max_height:
-                return font, wrapped
+        if best is None or best[0].size != lo:
+            font = get_font(self._font_path, lo)
+            best = font, self._wrap_text(text, font, max_width)
 
-        font = ImageFont.truetype(self._font_path, self.MIN_FONT_SIZE)
-        return font, self._wrap_text(text, font, max_width)
+        # Re-break the winning size with optimal fit for evener lines, as
+        # long as it doesn't need more lines than the greedy layout that fit.
+        font, lines = best
+        balanced = self._wrap_text_optimal(text, font, max_width)
+        if (
+            len(balanced) <= len(lines)
+            and self._block_height(font, balanced) <= max_height
+        ):
+            lines = balanced
+        return font, "\n".join(lines)
 
     def _draw_outlined_text(
         self,
@@ -84,32 +364,57 @@ class MemeTextRenderer:
         font: ImageFont.FreeTypeFont,
         anchor: str,
     ) -> None:
-        stroke_width = max(1, font.size // 12)
-        self._draw.multiline_text(
-            xy=xy,
-            text=text,
-            font=font,
-            fill=TEXT_FILL_COLOR,
-            stroke_fill=TEXT_STROKE_COLOR,
-            stroke_width=stroke_width,
-            anchor=anchor,
-            align="center",
-        )
+        """Blit *text* from the glyph atlas, centred on ``xy[0]``.
+
+        Each glyph's fill and FreeType-stroked outline are rasterised once,
+        when it enters the atlas; drawing is two pastes per glyph.
+
+        *anchor* follows Pillow's multiline anchors: ``"ma"`` puts the first
+        line's ascender at ``xy[1]``, ``"md"`` the last line's descender.
+        """
+        lines = text.split("\n")
+        line_pitch = self._line_pitch(font, _stroke_width(font))
+        x_center, y = xy
+        top = y
+        if anchor.endswith("d"):
+            ascent, descent = font.getmetrics()
+            top = y - (len(lines) - 1) * line_pitch - (ascent + descent)
+
+        placed: list[tuple[int, int, _Glyph]] = []
+        for index, line in enumerate(lines):
+            glyphs = [_get_glyph(font, char) for char in line]
+            # Snap the line origin once: per-glyph rounding of half-pixel
+            # positions would jitter the spacing between letters.
+            x = round(x_center - sum(glyph.advance for glyph in glyphs) / 2)
+            line_top = top + index * line_pitch
+            for glyph in glyphs:
+                placed.append((round(x), line_top, glyph))
+                x += glyph.advance
+
+        # All outlines first, so no stroke paints over a neighbour's fill.
+        for gx, gy, glyph in placed:
+            if glyph.stroke_mask is not None:
+                dx, dy = glyph.stroke_offset
+                self._image.paste(
+                    TEXT_STROKE_COLOR, (gx + dx, gy + dy), glyph.stroke_mask,
+                )
+        for gx, gy, glyph in placed:
+            if glyph.fill_mask is not None:
+                dx, dy = glyph.fill_offset
+                self._image.paste(
+                    TEXT_FILL_COLOR, (gx + dx, gy + dy), glyph.fill_mask,
+                )
 
     def _text_zone(self) -> tuple[int, int, int]:
         """Return (max_width, max_height, vertical_padding) for a text zone."""
-        h_pad = int(self._img_width * self.HORIZONTAL_PADDING_RATIO)
-        v_pad = int(self._img_height * self.VERTICAL_PADDING_RATIO)
-        max_width = self._img_width - 2 * h_pad
-        max_height = int(self._img_height * self.TEXT_ZONE_RATIO)
-        return max_width, max_height, v_pad
+        return self._max_width, self._max_height, self._v_pad
 
     def draw_top_text(self, text: str) -> None:
         """Draw *text* at the top of the image, centred and auto-sized."""
         max_width, max_height, v_pad = self._text_zone()
         font, wrapped = self._fit_text(text, max_width, max_height)
         self._draw_outlined_text(
-            xy=(self._img_width / 2, v_pad),
+            xy=(self._center_x, v_pad),
             text=wrapped,
             font=font,
             anchor="ma",
@@ -120,7 +425,7 @@ class MemeTextRenderer:
         max_width, max_height, v_pad = self._text_zone()
         font, wrapped = self._fit_text(text, max_width, max_height)
         self._draw_outlined_text(
-            xy=(self._img_width / 2, self._img_height - v_pad),
+            xy=(self._center_x, self._img_height - v_pad),
             text=wrapped,
             font=font,
             anchor="md",
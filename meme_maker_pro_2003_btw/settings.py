@@ -33,6 +33,7 @@ ALLOWED_HOSTS = []
 # Application definition
 
 INSTALLED_APPS = [
+    "daphne",
     "django.contrib.auth",
     "django.contrib.contenttypes",
     "django.contrib.sessions",
@@ -78,6 +79,8 @@ CACHES = {
 
 WSGI_APPLICATION = "meme_maker_pro_2003_btw.wsgi.application"
 
+ASGI_APPLICATION = "meme_maker_pro_2003_btw.asgi.application"
+
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
@@ -1,18 +1,22 @@
-import base64
+import asyncio
+import hashlib
 import os
-import queue
 import threading
 import time
-import uuid
 
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from itertools import islice
 
 from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
 from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.views import View
 from django_htmx.http import trigger_client_event
 from PIL import Image
+import pybase64
 
 from meme_maker_pro_2003_btw.meme_text_renderer import MemeTextRenderer
 
@@ -25,15 +29,60 @@ FORMAT_EXT = {
     "jpeg": "jpeg",
     "webp": "webp",
 }
+# Previews only feed a data URL, so favour encode speed over file size.
+SAVE_OPTIONS = {
+    "png": {"compress_level": 1, "optimize": False},
+    "jpeg": {"quality": 85, "optimize": False, "progressive": False},
+}
+
+# Decoding, resizing, glyph blits, libpng/libjpeg and base64 all spend most
+# of their time in C with the GIL released, so renders run in parallel off
+# the event loop.
+_RENDER_POOL = ThreadPoolExecutor(
+    max_workers=os.cpu_count(), thread_name_prefix="meme-render",
+)
+# Shared-meme persistence is I/O bound; a couple of threads is plenty.
+_IO_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="meme-io")
+
+
+_IMAGE_LIST_CACHE: dict[str, tuple[int, list[str]]] = {}
+_IMAGE_LIST_LOCK = threading.Lock()
+
+
+def _folder_path(folder: str) -> str:
+    return f"{settings.STATICFILES_DIRS[0]}{folder.rstrip('/')}"
 
 
 def image_list(from_folder: str) -> list[str]:
-    """Return sorted list of image filenames from the given static subfolder."""
-    static_root = settings.STATICFILES_DIRS[0]
-    return sorted(
-        [f for f in os.listdir(f"{static_root}{from_folder}") if f.endswith(tuple(FORMAT_EXT.keys()))],
-        reverse=True,
-    )
+    """Return sorted list of image filenames from the given static subfolder.
+
+    The listing is cached per folder and reused until the directory mtime
+    changes, so steady-state calls cost a single ``stat()``.
+    """
+    path = _folder_path(from_folder)
+    mtime_ns = os.stat(path).st_mtime_ns
+
+    with _IMAGE_LIST_LOCK:
+        cached = _IMAGE_LIST_CACHE.get(path)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+
+    extensions = tuple(FORMAT_EXT.keys())
+    with os.scandir(path) as entries:
+        files = sorted(
+            [entry.name for entry in entries if entry.name.endswith(extensions)],
+            reverse=True,
+        )
+
+    with _IMAGE_LIST_LOCK:
+        _IMAGE_LIST_CACHE[path] = (mtime_ns, files)
+    return files
+
+
+def invalidate_image_list(folder: str) -> None:
+    """Drop the cached listing of *folder* after writing into it."""
+    with _IMAGE_LIST_LOCK:
+        _IMAGE_LIST_CACHE.pop(_folder_path(folder), None)
 
 
 def get_file_path(file: str, folder: str) -> str:
@@ -41,41 +90,199 @@ def get_file_path(file: str, folder: str) -> str:
     return f"{settings.STATICFILES_DIRS[0]}{folder}{file}"
 
 
+_RESIZED_CACHE: OrderedDict[bytes, Image.Image] = OrderedDict()
+# Resized height is unbounded for tall uploads, so budget by pixel bytes and
+# never keep a single oversized image for the life of the process.
+_RESIZED_CACHE_MAX_BYTES = 32 * 1024 * 1024
+_RESIZED_CACHE_MAX_ENTRY_BYTES = 4 * 1024 * 1024
+_RESIZED_CACHE_LOCK = threading.Lock()
+_resized_cache_bytes = 0
+
+
+def _image_nbytes(image: Image.Image) -> int:
+    return image.width * image.height * len(image.getbands())
+
+
+def _load_resized(data: bytes) -> Image.Image:
+    """Decode an uploaded image and scale it to ``IMAGE_BASE_WIDTH``.
+
+    The form re-posts the same upload on every text change, so results are
+    kept in a byte-bounded LRU keyed by a digest of the file contents; images
+    above ``_RESIZED_CACHE_MAX_ENTRY_BYTES`` are not cached. The returned
+    image is shared: callers must ``copy()`` it before drawing on it.
+    """
+    key = hashlib.blake2b(data, digest_size=16).digest()
+    with _RESIZED_CACHE_LOCK:
+        cached = _RESIZED_CACHE.get(key)
+        if cached is not None:
+            _RESIZED_CACHE.move_to_end(key)
+            return cached
+
+    pil_img = Image.open(BytesIO(data))
+    wpercent = IMAGE_BASE_WIDTH / float(pil_img.size[0])
+    hsize = int(float(pil_img.size[1]) * wpercent)
+    # JPEG only: let libjpeg decode at a reduced DCT scale that is still
+    # >= the target size, instead of decoding at full resolution.
+    pil_img.draft("RGB", (IMAGE_BASE_WIDTH, hsize))
+    # Normalise once here rather than paying palette/greyscale handling on
+    # every draw; keep alpha when the upload has any.
+    target_mode = "RGBA" if pil_img.has_transparency_data else "RGB"
+    if pil_img.mode != target_mode:
+        pil_img = pil_img.convert(target_mode)
+
+    src_width = pil_img.size[0]
+    if src_width != IMAGE_BASE_WIDTH:
+        # LANCZOS buys almost nothing over BILINEAR below a 2x downscale.
+        if src_width < 2 * IMAGE_BASE_WIDTH:
+            resample = Image.Resampling.BILINEAR
+        else:
+            resample = Image.Resampling.LANCZOS
+        pil_img = pil_img.resize((IMAGE_BASE_WIDTH, hsize), resample)
+    pil_img.load()
+
+    nbytes = _image_nbytes(pil_img)
+    if nbytes > _RESIZED_CACHE_MAX_ENTRY_BYTES:
+        return pil_img
+
+    global _resized_cache_bytes
+    with _RESIZED_CACHE_LOCK:
+        if key not in _RESIZED_CACHE:
+            _RESIZED_CACHE[key] = pil_img
+            _resized_cache_bytes += nbytes
+        while _resized_cache_bytes > _RESIZED_CACHE_MAX_BYTES:
+            _, evicted = _RESIZED_CACHE.popitem(last=False)
+            _resized_cache_bytes -= _image_nbytes(evicted)
+    return pil_img
+
+
+def _encode_image(image: Image.Image, save_format: str) -> str:
+    """Compress *image* as *save_format* and return it base64-encoded.
+
+    Uses the fast encoder settings from ``SAVE_OPTIONS``, and the encoder
+    reads the buffer in place instead of copying it out with ``getvalue()``.
+    """
+    buffered = BytesIO()
+    image.save(
+        buffered, format=save_format, **SAVE_OPTIONS.get(save_format, {}),
+    )
+    with buffered.getbuffer() as view:
+        return pybase64.b64encode(view).decode("ascii")
+
+
+def _render_meme(
+    upload_file: UploadedFile,
+    top_text: str | None,
+    bottom_text: str | None,
+    save_format: str,
+) -> str:
+    """Blocking meme pipeline: read, decode, caption and encode the upload."""
+    pil_img = _load_resized(upload_file.read()).copy()
+
+    renderer = MemeTextRenderer(
+        pil_img, get_file_path("impact.ttf", "/fonts/"),
+    )
+    if top_text:
+        renderer.draw_top_text(top_text)
+    if bottom_text:
+        renderer.draw_bottom_text(bottom_text)
+
+    return _encode_image(pil_img, save_format)
+
+
+def _persist_shared(file_name: str, encoded_string: str) -> None:
+    """Decode a shared meme and write it into the ``/shared`` folder."""
+    raw = pybase64.b64decode(encoded_string, validate=False)
+    with open(get_file_path(file_name, "/shared/"), "wb") as f:
+        f.write(raw)
+    invalidate_image_list("/shared/")
+
+
 class SSEBroker:
     """Thread-safe pub/sub broker that broadcasts SSE messages to all subscribers.
 
-    Each SSE client gets its own ``queue.Queue``.  When ``broadcast()`` is
-    called, the message is pushed into every active queue so that **all**
-    connected tabs / users receive the event.
+    Messages are appended once to a shared ring buffer, tagged with an
+    increasing sequence number.  Each subscriber remembers the last sequence
+    number it has seen and reads only newer entries, so message memory does
+    not grow with the number of tabs / users connected.  A subscriber that
+    falls more than ``RING_SIZE`` messages behind misses the oldest ones.
+
+    Subscribers wait on an ``asyncio.Event`` shared by everyone on their
+    event loop rather than on a thread, so idle SSE connections hold no
+    threads at all.  ``broadcast()`` swaps out each loop's event and sets it
+    with one ``call_soon_threadsafe``, so its cost is O(event loops), not
+    O(subscribers).
     """
 
+    RING_SIZE = 1024
+
     def __init__(self) -> None:
-        self._subscribers: dict[str, queue.Queue[str]] = {}
+        self._ring: deque[tuple[int, str]] = deque(maxlen=self.RING_SIZE)
+        self._seq = 0
+        self._subscribers = 0
+        self._wakeups: dict[asyncio.AbstractEventLoop, asyncio.Event] = {}
         self._lock = threading.Lock()
 
-    def subscribe(self) -> tuple[str, queue.Queue[str]]:
-        """Register a new subscriber and return (subscriber_id, queue)."""
-        subscriber_id = uuid.uuid4().hex
-        subscriber_queue: queue.Queue[str] = queue.Queue()
+    def subscribe(self) -> int:
+        """Register a new subscriber and return the sequence it has seen."""
         with self._lock:
-            self._subscribers[subscriber_id] = subscriber_queue
-        return subscriber_id, subscriber_queue
+            self._subscribers += 1
+            return self._seq
 
-    def unsubscribe(self, subscriber_id: str) -> None:
-        """Remove a subscriber when the SSE connection is closed."""
+    def unsubscribe(self) -> None:
+        """Forget a subscriber when the SSE connection is closed."""
         with self._lock:
-            self._subscribers.pop(subscriber_id, None)
+            self._subscribers -= 1
 
     def broadcast(self, message: str) -> None:
-        """Push *message* into every subscriber's queue (non-blocking)."""
+        """Publish *message* to every subscriber (non-blocking)."""
         with self._lock:
-            for subscriber_queue in self._subscribers.values():
-                subscriber_queue.put_nowait(message)
+            self._seq += 1
+            self._ring.append((self._seq, message))
+            wakeups = list(self._wakeups.items())
+            self._wakeups.clear()
+        for loop, wakeup in wakeups:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # The loop was closed; its waiters are gone with it.
+                pass
+
+    async def wait_for_messages(
+        self,
+        last_seq: int,
+        timeout: float,
+    ) -> tuple[int, list[str]]:
+        """Wait until messages newer than *last_seq* arrive or *timeout*
+        expires; return (latest sequence, new messages in order)."""
+        loop = asyncio.get_running_loop()
+        wakeup = None
+        with self._lock:
+            if self._seq == last_seq:
+                # Set and dropped by the next broadcast; later waiters then
+                # start a fresh event, so nothing needs unregistering here.
+                wakeup = self._wakeups.get(loop)
+                if wakeup is None:
+                    wakeup = self._wakeups[loop] = asyncio.Event()
+
+        if wakeup is not None:
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        with self._lock:
+            newer = min(self._seq - last_seq, len(self._ring))
+            messages = [
+                message for _, message in islice(reversed(self._ring), newer)
+            ]
+            latest = self._seq
+        messages.reverse()
+        return latest, messages
 
     @property
     def subscriber_count(self) -> int:
         with self._lock:
-            return len(self._subscribers)
+            return self._subscribers
 
 
 sse_broker = SSEBroker()
@@ -98,7 +305,7 @@ def format_sse(data: str, event: str | None = None) -> str:
 class StreamView(View):
     """SSE endpoint that broadcasts shared memes to every connected client."""
 
-    def get(self, request: HttpRequest) -> StreamingHttpResponse:
+    async def get(self, request: HttpRequest) -> StreamingHttpResponse:
         response = StreamingHttpResponse(
             self._event_stream(),
             content_type="text/event-stream",
@@ -108,21 +315,21 @@ class StreamView(View):
         return response
 
     @staticmethod
-    def _event_stream():
-        subscriber_id, subscriber_queue = sse_broker.subscribe()
+    async def _event_stream():
+        # Under ASGI a sync iterator would be drained into a list before
+        # sending, which never finishes for an endless stream.
+        last_seq = sse_broker.subscribe()
         try:
             while True:
-                try:
-                    message = subscriber_queue.get(
-                        timeout=KEEPALIVE_INTERVAL_SECONDS,
-                    )
-                    yield message
-                except queue.Empty:
+                last_seq, messages = await sse_broker.wait_for_messages(
+                    last_seq, KEEPALIVE_INTERVAL_SECONDS,
+                )
+                if not messages:
                     yield ": keepalive\n\n"
-        except GeneratorExit:
-            pass
+                for message in messages:
+                    yield message
         finally:
-            sse_broker.unsubscribe(subscriber_id)
+            sse_broker.unsubscribe()
 
 
 class IndexView(View):
@@ -138,7 +345,7 @@ class IndexView(View):
 class MemeView(View):
     template_name = "meme.html"
 
-    def post(self, request: HttpRequest) -> HttpResponse:
+    async def post(self, request: HttpRequest) -> HttpResponse:
         top_text = request.POST.get("top_text")
         bottom_text = request.POST.get("bottom_text")
         encoded_string = request.POST.get("encoded_string")
@@ -155,8 +362,11 @@ class MemeView(View):
 
         if is_share:
             file_name = f"{int(time.time())}.{file_ext}"
-            with open(get_file_path(file_name, "/shared/"), "wb+") as f:
-                f.write(base64.b64decode(encoded_string))
+            # The broadcast below points clients at the file, so it has to
+            # be on disk first; the event loop stays free meanwhile.
+            await asyncio.get_running_loop().run_in_executor(
+                _IO_POOL, _persist_shared, file_name, encoded_string,
+            )
 
             sse_broker.broadcast(
                 format_sse(
@@ -173,30 +383,16 @@ class MemeView(View):
         if not upload_file:
             return render(request, self.template_name)
 
-        pil_img = Image.open(upload_file)
         original_name = upload_file.name or "upload.png"
         output_ext = original_name.rsplit(".", 1)[-1].lower()
-
-        wpercent = IMAGE_BASE_WIDTH / float(pil_img.size[0])
-        hsize = int(float(pil_img.size[1]) * wpercent)
-        pil_img = pil_img.resize(
-            (IMAGE_BASE_WIDTH, hsize), Image.Resampling.LANCZOS,
-        )
-
-        renderer = MemeTextRenderer(
-            pil_img, get_file_path("impact.ttf", "/fonts/"),
+        ctx["encoded_string"] = await asyncio.get_running_loop().run_in_executor(
+            _RENDER_POOL,
+            _render_meme,
+            upload_file,
+            top_text,
+            bottom_text,
+            FORMAT_EXT.get(output_ext, "png"),
         )
-        if top_text:
-            renderer.draw_top_text(top_text)
-        if bottom_text:
-            renderer.draw_bottom_text(bottom_text)
-
-        save_format = FORMAT_EXT.get(output_ext, "png")
-        buffered = BytesIO()
-        pil_img.save(buffered, format=save_format)
-
-        encoded_string = base64.b64encode(buffered.getvalue())
-        ctx["encoded_string"] = encoded_string.decode("utf-8")
         ctx["file_ext"] = output_ext
 
         return render(request, self.template_name, context=ctx)